@@ -1,4 +1,4 @@
-from typing import Generator
+from typing import Annotated, Generator
 from app.core.security import get_current_user, TokenData
 from fastapi import Depends
 
@@ -20,8 +20,12 @@ from fastapi import Depends
 # For this boilerplate, I will demonstrate using the Service Key for admin tasks (or generic backend tasks)
 # AND parsing the user from the token for context.
 
+# Typing alias for the authenticated user dependency, so signatures can use
+# `current_user: CurrentUser` instead of repeating Depends(get_current_user).
+CurrentUser = Annotated[TokenData, Depends(get_current_user)]
+
 async def get_current_active_user(
-    current_user: TokenData = Depends(get_current_user),
+    current_user: CurrentUser,
 ) -> TokenData:
     # Here you could check if the user is active in your database if needed
     return current_user
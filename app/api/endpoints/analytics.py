@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from typing import Any
 from pydantic import BaseModel
 
+from app.core.responses import ORJSONResponse
 from app.services.analytics_service import analytics_service
 
 router = APIRouter()
@@ -9,11 +9,11 @@ router = APIRouter()
 class AnalyticsRequest(BaseModel):
     test_attempt_id: str
 
-@router.post("/process-attempt", response_model=Any)
+@router.post("/process-attempt", response_model=None, response_class=ORJSONResponse)
 async def process_test_attempt(
     request: AnalyticsRequest,
     background_tasks: BackgroundTasks
-) -> Any:
+) -> ORJSONResponse:
     """
     Process a completed test attempt to update user analytics.
 
@@ -24,7 +24,9 @@ async def process_test_attempt(
     """
     try:
         result = await analytics_service.process_test_attempt(request.test_attempt_id)
-        return result
+        # Built by the service from known fields; returned as-is instead of being
+        # re-validated and re-encoded through jsonable_encoder
+        return ORJSONResponse(content=result)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
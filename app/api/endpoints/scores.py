@@ -1,31 +1,160 @@
+import asyncio
 import logging
+import time
+import uuid
 import httpx
-from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Annotated, Dict, List, Optional, Tuple
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from postgrest import ReturnMethod
+from supabase import AsyncClient
 from app.core.security import verify_token, TokenData
+from app.core.cache import TTLCache
 from app.core.config import settings
+from app.core.http import http_client, send_with_retry
 from app.core.supabase import db
-from app.services.score_service import score_service
+from app.services.score_service import PreparedPaper, score_service
 from app.services.analytics_service import analytics_service
-from app.schemas.score import ScoreResponse
+from app.schemas.score import ScoreBatchRequest, ScoreBatchResponse, ScoreResponse
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Settings are fixed for the process lifetime; read the flag once
+_AUTH_ENABLED = settings.ENABLE_AUTH
+
 # Use a separate scheme for optional auth, allowing auto_error=False
 oauth2_scheme_optional = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/auth/login",
     auto_error=False
 )
 
+# Test definitions are effectively immutable per URL, so keep recently used ones in memory
+# as (fresh_until, etag, ppt, paper), where paper is ppt prepared for scoring. Entries are
+# served as-is for _PPT_FRESH_SECONDS, then revalidated with If-None-Match so an unchanged
+# file comes back as a bodiless 304 and keeps its prepared paper. Cached dicts are shared
+# between requests and must be treated as read-only, since their paper was prepared from them.
+_PPT_FRESH_SECONDS = 3600
+_ppt_cache = TTLCache(maxsize=1024, ttl=24 * 3600)
+# Last seen `tests.url` per test ID, used to start the JSON fetch speculatively.
+_test_urls = TTLCache(maxsize=1024, ttl=3600)
+_ppt_locks: Dict[str, asyncio.Lock] = {}
+
+# Papers with more questions than this take over ~1 ms to prepare or score and run in a worker thread
+_THREADPOOL_SCORING_THRESHOLD = 1000
+
+# Student tests scored concurrently by the batch endpoint
+_BATCH_CONCURRENCY = 8
+
+# Score calculations currently running, keyed by student_test_id
+_in_flight: Dict[str, "asyncio.Future[ScoreResponse]"] = {}
+
+async def _get_ppt(test_url: str) -> Tuple[dict, PreparedPaper]:
+    """
+    Returns the test definition JSON for `test_url` and its prepared form, fetching
+    and preparing it on a cache miss. Concurrent misses for the same URL share a
+    single fetch.
+    """
+    cached = _ppt_cache.get(test_url)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[2], cached[3]
+
+    lock = _ppt_locks.setdefault(test_url, asyncio.Lock())
+    try:
+        async with lock:
+            cached = _ppt_cache.get(test_url)
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[2], cached[3]
+
+            headers = {}
+            if cached is not None and cached[1]:
+                headers["If-None-Match"] = cached[1]
+
+            client = await http_client.get_client()
+            resp = await send_with_retry(client, "GET", test_url, headers=headers)
+
+            if resp.status_code == 304 and cached is not None:
+                etag, ppt_data, paper = cached[1], cached[2], cached[3]
+            else:
+                resp.raise_for_status()
+                ppt_data, etag = resp.json(), resp.headers.get("etag")
+                if len(ppt_data.get("questions", [])) > _THREADPOOL_SCORING_THRESHOLD:
+                    paper = await asyncio.to_thread(score_service.prepare_paper, ppt_data)
+                else:
+                    paper = score_service.prepare_paper(ppt_data)
+
+            _ppt_cache.set(test_url, (time.monotonic() + _PPT_FRESH_SECONDS, etag, ppt_data, paper))
+            return ppt_data, paper
+    finally:
+        if _ppt_locks.get(test_url) is lock:
+            del _ppt_locks[test_url]
+
+async def _fetch_test_url(supabase: AsyncClient, test_id: str) -> str:
+    """
+    Looks up the test definition URL for `test_id` in the `tests` table.
+    """
+    try:
+        test_response = await supabase.table("tests").select("url").eq("testID", test_id).maybe_single().execute()
+    except Exception as e:
+        logger.error(f"Error fetching test definition: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching test definition")
+
+    # maybe_single() yields no response at all when the row is missing
+    if not test_response or not test_response.data:
+        raise HTTPException(status_code=404, detail="Test definition not found")
+
+    test_url = test_response.data.get("url")
+    if not test_url:
+        raise HTTPException(status_code=400, detail="Test URL missing in test record")
+
+    _test_urls.set(test_id, test_url)
+    return test_url
+
+async def _fetch_ppt(test_url: str) -> Tuple[dict, PreparedPaper]:
+    """
+    Fetches the test JSON from its GitHub raw URL together with its prepared form,
+    mapping failures to a 502.
+    """
+    try:
+        return await _get_ppt(test_url)
+    except (httpx.HTTPError, ValueError) as e:
+        logger.error(f"Error fetching test JSON from {test_url}: {e}")
+        raise HTTPException(status_code=502, detail="Error fetching test definition from external source")
+    except Exception as e:
+        # The JSON parsed but isn't a paper calculate_score can handle
+        logger.error(f"Error preparing test JSON from {test_url}: {e}")
+        raise HTTPException(status_code=502, detail="Invalid test definition from external source")
+
+async def _run_analytics(student_test_id: str, score_data: dict) -> None:
+    try:
+        logger.info(f"Triggering analytics for {student_test_id}")
+        await analytics_service.process_test_attempt(student_test_id, score_data=score_data)
+    except Exception as e:
+        logger.error(f"Error triggering analytics for {student_test_id}: {e}")
+        # Analytics failures must not affect the already-sent score response,
+        # but we should log them.
+
+async def _run_analytics_by_user(user_tasks: List[BackgroundTasks]) -> None:
+    # BackgroundTasks runs its own tasks one after another; the users run side by side
+    await asyncio.gather(*(tasks() for tasks in user_tasks))
+
+def _canonical_uuid(value: str) -> Optional[str]:
+    """
+    Returns `value` in canonical (lowercase, hyphenated) UUID form, or None if it
+    isn't a UUID. Postgres matches UUIDs in any spelling, but rows come back canonical.
+    """
+    try:
+        return str(uuid.UUID(value))
+    except ValueError:
+        return None
+
 def get_current_user_conditional(token: Optional[str] = Depends(oauth2_scheme_optional)) -> Optional[TokenData]:
     """
     Returns current user if authentication is enabled and token is valid.
     If authentication is disabled via settings, returns None.
     If authentication is enabled but token is invalid/missing, raises HTTPException.
     """
-    if not settings.ENABLE_AUTH:
+    if not _AUTH_ENABLED:
         return None
 
     if not token:
@@ -36,6 +165,9 @@ def get_current_user_conditional(token: Optional[str] = Depends(oauth2_scheme_op
         )
     return verify_token(token)
 
+# Typing alias shared by the score endpoints' current_user parameters
+OptionalCurrentUser = Annotated[Optional[TokenData], Depends(get_current_user_conditional)]
+
 @router.post(
     "/{student_test_id}/calculate",
     response_model=ScoreResponse,
@@ -44,7 +176,8 @@ def get_current_user_conditional(token: Optional[str] = Depends(oauth2_scheme_op
 )
 async def calculate_student_test_score(
     student_test_id: str,
-    current_user: Optional[TokenData] = Depends(get_current_user_conditional),
+    background_tasks: BackgroundTasks,
+    current_user: OptionalCurrentUser,
 ) -> ScoreResponse:
     """
     Calculate scores for a student test and push results to GitHub.
@@ -59,21 +192,112 @@ async def calculate_student_test_score(
     # Use service client to bypass RLS if configured
     supabase = await db.get_service_client()
 
-    # 1. Fetch student_tests row
+    # 1. Fetch the ownership and result columns of the student_tests row. This small
+    # read is all the already-calculated fast path needs.
     try:
-        response = await supabase.table("student_tests").select("*").eq("id", student_test_id).execute()
+        response = await supabase.table("student_tests").select("user_id,result_url").eq("id", student_test_id).maybe_single().execute()
     except Exception as e:
         logger.error(f"Error fetching student test: {e}")
         raise HTTPException(status_code=500, detail="Error fetching student test")
 
-    student_test = response.data
+    student_test = response.data if response else None
     if not student_test:
         logger.warning(f"Student test {student_test_id} not found. Check if ID is correct and if RLS allows access.")
         raise HTTPException(status_code=404, detail="Student test not found")
-    student_test = student_test[0]
 
+    return await _score_student_test(supabase, student_test_id, student_test, current_user, background_tasks)
+
+@router.post(
+    "/batch",
+    response_model=ScoreBatchResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Calculate Scores for Multiple Student Tests",
+)
+async def calculate_student_test_scores_batch(
+    request: ScoreBatchRequest,
+    background_tasks: BackgroundTasks,
+    current_user: OptionalCurrentUser,
+) -> ScoreBatchResponse:
+    """
+    Calculate scores for several student tests in one request.
+
+    - **student_test_ids**: UUIDs of the student tests to calculate (at most 50).
+
+    The student_tests rows are fetched with a single query; tests that were already
+    scored return their existing URL. Failures, including IDs that aren't UUIDs, are
+    reported per ID in **errors** instead of failing the whole batch.
+    """
+    supabase = await db.get_service_client()
+    student_test_ids = list(dict.fromkeys(request.student_test_ids))
+    # Rows are matched back to the requested IDs in canonical form, so IDs sent in
+    # another case still find their row
+    canonical_ids = {student_test_id: _canonical_uuid(student_test_id) for student_test_id in student_test_ids}
+    errors: Dict[str, str] = {
+        student_test_id: "Invalid student test ID"
+        for student_test_id, canonical_id in canonical_ids.items()
+        if canonical_id is None
+    }
+    valid_ids = list(dict.fromkeys(canonical_id for canonical_id in canonical_ids.values() if canonical_id))
+
+    rows: Dict[str, dict] = {}
+    if valid_ids:
+        try:
+            response = await supabase.table("student_tests").select("id,user_id,result_url").in_("id", valid_ids).execute()
+        except Exception as e:
+            logger.error(f"Error fetching student tests: {e}")
+            raise HTTPException(status_code=500, detail="Error fetching student tests")
+        rows = {_canonical_uuid(str(row.get("id"))): row for row in response.data or []}
+
+    semaphore = asyncio.Semaphore(_BATCH_CONCURRENCY)
+    scored: Dict[str, ScoreResponse] = {}
+    # Analytics for the scored attempts, grouped by user. Each user's attempts must
+    # run in order (they accumulate into one user_analytics row and the same
+    # GitHub files), but different users' run concurrently.
+    analytics_by_user: Dict[str, BackgroundTasks] = {}
+
+    async def score_one(student_test_id: str) -> None:
+        if student_test_id in errors:
+            return
+        canonical_id = canonical_ids[student_test_id]
+        student_test = rows.get(canonical_id)
+        if not student_test:
+            errors[student_test_id] = "Student test not found"
+            return
+        async with semaphore:
+            try:
+                # Scored under the canonical ID, so the result file name and the
+                # in-flight coalescing don't depend on how the ID was spelled
+                user_analytics = analytics_by_user.setdefault(str(student_test.get("user_id")), BackgroundTasks())
+                scored[student_test_id] = await _score_student_test(
+                    supabase, canonical_id, student_test, current_user, user_analytics
+                )
+            except HTTPException as e:
+                errors[student_test_id] = str(e.detail)
+            except Exception as e:
+                # Anything unexpected is still reported against this ID only
+                logger.error(f"Error scoring student test {student_test_id}: {e}")
+                errors[student_test_id] = "Error calculating score"
+
+    await asyncio.gather(*(score_one(student_test_id) for student_test_id in student_test_ids))
+    if analytics_by_user:
+        background_tasks.add_task(_run_analytics_by_user, list(analytics_by_user.values()))
+
+    # Keep results in request order
+    results = [scored[student_test_id] for student_test_id in student_test_ids if student_test_id in scored]
+    return ScoreBatchResponse(results=results, errors=errors)
+
+async def _score_student_test(
+    supabase: AsyncClient,
+    student_test_id: str,
+    student_test: dict,
+    current_user: Optional[TokenData],
+    background_tasks: BackgroundTasks,
+) -> ScoreResponse:
+    """
+    Runs the scoring pipeline for one student test, given its `user_id`/`result_url` columns.
+    """
     # 2. Verify user ownership (only if auth is enabled)
-    if settings.ENABLE_AUTH:
+    if _AUTH_ENABLED:
         # Should not happen if get_current_user_conditional works correctly,
         # but for type safety and double check:
         if not current_user:
@@ -88,42 +312,84 @@ async def calculate_student_test_score(
         logger.info(f"Score already calculated for {student_test_id}. Returning existing URL.")
         return ScoreResponse(student_test_id=student_test_id, github_url=existing_result_url)
 
-    test_id = student_test.get("test_id")
-    answers = student_test.get("answers")
+    # Concurrent requests for the same attempt (e.g. client retries) share one calculation
+    pending = _in_flight.get(student_test_id)
+    if pending is not None:
+        logger.info(f"Score calculation for {student_test_id} already in progress. Waiting for it.")
+        return await asyncio.shield(pending)
 
-    if not test_id:
-        raise HTTPException(status_code=400, detail="Test ID missing in student test record")
+    future: "asyncio.Future[ScoreResponse]" = asyncio.get_running_loop().create_future()
+    _in_flight[student_test_id] = future
+    try:
+        score_response = await _calculate_and_store(supabase, student_test_id, background_tasks)
+    except asyncio.CancelledError:
+        # The owning request went away (e.g. client disconnect). Requests waiting on
+        # it weren't cancelled themselves, so give them a retryable error instead.
+        future.set_exception(HTTPException(status_code=503, detail="Score calculation was interrupted, please retry"))
+        future.exception()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # mark retrieved so an unawaited future doesn't log it again
+        raise
+    else:
+        future.set_result(score_response)
+        return score_response
+    finally:
+        del _in_flight[student_test_id]
 
-    # 3. Fetch tests row
+async def _calculate_and_store(
+    supabase: AsyncClient,
+    student_test_id: str,
+    background_tasks: BackgroundTasks,
+) -> ScoreResponse:
+    """
+    Scores a student test that has no result yet, pushes the result to GitHub,
+    records its URL and schedules analytics to run after the response is sent.
+    """
+    # Only now pull the (potentially large) answers payload
     try:
-        test_response = await supabase.table("tests").select("*").eq("testID", test_id).execute()
+        attempt_response = await supabase.table("student_tests").select("test_id,answers").eq("id", student_test_id).maybe_single().execute()
     except Exception as e:
-        logger.error(f"Error fetching test definition: {e}")
-        raise HTTPException(status_code=500, detail="Error fetching test definition")
+        logger.error(f"Error fetching student test answers: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching student test")
 
-    test_record = test_response.data
-    if not test_record:
-        raise HTTPException(status_code=404, detail="Test definition not found")
-    test_record = test_record[0]
+    attempt = attempt_response.data if attempt_response else None
+    if not attempt:
+        raise HTTPException(status_code=404, detail="Student test not found")
 
-    test_url = test_record.get("url")
-    if not test_url:
-        raise HTTPException(status_code=400, detail="Test URL missing in test record")
+    test_id = attempt.get("test_id")
+    answers = attempt.get("answers")
 
-    # 4. Fetch test JSON from GitHub raw URL
-    ppt_data = {}
-    try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(test_url)
-            resp.raise_for_status()
-            ppt_data = resp.json()
-    except Exception as e:
-        logger.error(f"Error fetching test JSON from {test_url}: {e}")
-        raise HTTPException(status_code=502, detail="Error fetching test definition from external source")
+    if not test_id:
+        raise HTTPException(status_code=400, detail="Test ID missing in student test record")
 
-    # 5. Calculate scores
+    # 3-4. Resolve the test URL and fetch the test JSON. When this test's URL is
+    # already known, the JSON fetch runs concurrently with the `tests` lookup.
+    known_url = _test_urls.get(test_id)
+    if known_url:
+        test_url, fetched = await asyncio.gather(
+            _fetch_test_url(supabase, test_id),
+            _fetch_ppt(known_url),
+            return_exceptions=True,
+        )
+        if isinstance(test_url, BaseException):
+            raise test_url
+        if isinstance(fetched, BaseException) or test_url != known_url:
+            fetched = await _fetch_ppt(test_url)
+    else:
+        test_url = await _fetch_test_url(supabase, test_id)
+        fetched = await _fetch_ppt(test_url)
+    ppt_data, paper = fetched
+
+    # 5. Calculate scores. Scoring costs about a microsecond per question once the
+    # paper has been prepared (cached with it in _ppt_cache), so only large papers
+    # are worth moving off the event loop.
     try:
-        result = score_service.calculate_score(ppt_data, answers or {})
+        if len(ppt_data.get("questions", [])) > _THREADPOOL_SCORING_THRESHOLD:
+            result = await asyncio.to_thread(score_service.calculate_score, ppt_data, answers or {}, paper)
+        else:
+            result = score_service.calculate_score(ppt_data, answers or {}, paper)
     except Exception as e:
         logger.error(f"Error calculating score: {e}")
         raise HTTPException(status_code=500, detail="Error calculating score")
@@ -134,26 +400,27 @@ async def calculate_student_test_score(
         # Create a filename based on student_test_id
         filename = f"{student_test_id}.json"
         github_url = await score_service.push_to_github(result, filename)
-    except Exception as e:
+    except (httpx.HTTPError, ValueError) as e:
         logger.error(f"Error pushing results to GitHub: {e}")
         raise HTTPException(status_code=502, detail=f"Error pushing results to GitHub: {str(e)}")
 
-    # 7. Update student_tests with result_url
+    # 7. Update student_tests with result_url. Nothing reads the updated row back,
+    # so skip the representation (which would echo the full answers payload).
     try:
-        await supabase.table("student_tests").update({"result_url": github_url}).eq("id", student_test_id).execute()
+        await (
+            supabase.table("student_tests")
+            .update({"result_url": github_url}, returning=ReturnMethod.minimal)
+            .eq("id", student_test_id)
+            .execute()
+        )
     except Exception as e:
         logger.error(f"Error updating student_tests with result URL: {e}")
         # Not raising 500 here because the file was successfully pushed.
         # But we should probably alert the user or at least log it.
         # Returning the URL anyway.
 
-    # 8. Trigger Analytics (as requested: using the same test ID, after full completion of score calculation)
-    try:
-        logger.info(f"Triggering analytics for {student_test_id}")
-        await analytics_service.process_test_attempt(student_test_id, score_data=result)
-    except Exception as e:
-        logger.error(f"Error triggering analytics for {student_test_id}: {e}")
-        # We don't want to fail the score response if analytics fails,
-        # but we should log it.
+    # 8. Trigger Analytics (as requested: using the same test ID, after full completion of score calculation).
+    # The response doesn't depend on it, so it runs as a background task once the response is sent.
+    background_tasks.add_task(_run_analytics, student_test_id, result)
 
     return ScoreResponse(student_test_id=student_test_id, github_url=github_url)
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Generic, Hashable, List, Set, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+R = TypeVar("R")
+
+class KeyedCoalescer(Generic[K, T, R]):
+    """
+    Serialises calls to `handler(key, items)` per key and merges the items that
+    queue up behind a running call.
+
+    An item submitted while nothing is running for its key is handled straight
+    away, with no waiting window. Items submitted for that key while a call is in
+    flight are handed to the next call together. Every caller in a call receives
+    its result, or its exception if the handler raises.
+    """
+
+    def __init__(self, handler: Callable[[K, List[T]], Awaitable[R]]):
+        self._handler = handler
+        self._pending: Dict[K, List[Tuple[T, "asyncio.Future[R]"]]] = {}
+        self._running: Set[K] = set()
+        # Strong references so running drains aren't garbage collected
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, key: K, item: T) -> R:
+        future: "asyncio.Future[R]" = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(key, []).append((item, future))
+
+        if key not in self._running:
+            self._running.add(key)
+            task = asyncio.create_task(self._drain(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        return await asyncio.shield(future)
+
+    async def _drain(self, key: K) -> None:
+        try:
+            while True:
+                batch = self._pending.pop(key, None)
+                if not batch:
+                    return
+                await self._run(key, batch)
+        finally:
+            self._running.discard(key)
+
+    async def _run(self, key: K, batch: List[Tuple[T, "asyncio.Future[R]"]]) -> None:
+        try:
+            result = await self._handler(key, [item for item, _ in batch])
+        except Exception as e:
+            logger.error(f"Call for {key!r} with {len(batch)} items failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()  # retrieved by the waiting caller; avoid a duplicate log
+            return
+
+        for _, future in batch:
+            if not future.done():
+                future.set_result(result)
@@ -1,7 +1,8 @@
+import json
 import os
-from typing import List, Union, Optional
-from pydantic import AnyHttpUrl, validator
-from pydantic_settings import BaseSettings
+from typing import Annotated, List, Tuple, Union, Optional
+from pydantic import AnyHttpUrl, field_validator
+from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -20,18 +21,22 @@ class Settings(BaseSettings):
 
     ENABLE_AUTH: bool = False
 
-    # CORS
-    BACKEND_CORS_ORIGINS: List[Union[str, AnyHttpUrl]] = []
+    # CORS. NoDecode hands the raw env string to the validator below, which accepts
+    # either a JSON list or a comma-separated list
+    BACKEND_CORS_ORIGINS: Annotated[Tuple[Union[str, AnyHttpUrl], ...], NoDecode] = ()
 
-    @validator("BACKEND_CORS_ORIGINS", pre=True)
-    def assemble_cors_origins(cls, v: Union[str, List[str]]) -> Union[List[str], str]:
+    @field_validator("BACKEND_CORS_ORIGINS", mode="before")
+    @classmethod
+    def assemble_cors_origins(cls, v: Union[str, List[str], Tuple[str, ...]]) -> Tuple[str, ...]:
+        # Parsed once into an immutable tuple when Settings is built
         if isinstance(v, str) and not v.startswith("["):
-            return [i.strip() for i in v.split(",")]
-        elif isinstance(v, (list, str)):
-            return v
+            return tuple(i.strip() for i in v.split(",") if i.strip())
+        elif isinstance(v, str):
+            return tuple(json.loads(v))
+        elif isinstance(v, (list, tuple)):
+            return tuple(v)
         raise ValueError(v)
 
-    class Config:
-        case_sensitive = True
+    model_config = SettingsConfigDict(case_sensitive=True)
 
 settings = Settings()
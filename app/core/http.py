@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import random
+from typing import Any, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying after a short wait (rate limiting, upstream hiccups)
+RETRYABLE_STATUS_CODES = frozenset({429, 502, 503, 504})
+# A 5xx from a gateway doesn't say whether the request was applied, so those are only
+# retried for methods that are safe to repeat. A GitHub contents PUT that committed
+# behind a 502 would otherwise be resent and land twice.
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+# Errors raised before the request reached the server, so any method is safe to resend
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+class HTTPClientManager:
+    """
+    Owns a single pooled httpx.AsyncClient so outbound calls (GitHub, raw test
+    JSON) reuse keep-alive connections instead of paying a TLS handshake each time.
+    """
+    client: Optional[httpx.AsyncClient] = None
+    _lock: asyncio.Lock = asyncio.Lock()
+
+    @classmethod
+    async def get_client(cls) -> httpx.AsyncClient:
+        if cls.client is None:
+            async with cls._lock:
+                if cls.client is None:
+                    cls.client = httpx.AsyncClient(
+                        # GitHub serves HTTP/2, so concurrent calls (history and chapter
+                        # stats writes) multiplex over one connection
+                        http2=True,
+                        timeout=httpx.Timeout(30.0, connect=10.0),
+                        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+                    )
+        return cls.client
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls.client is not None:
+            await cls.client.aclose()
+            cls.client = None
+            logger.info("Shared HTTP client closed.")
+
+def _backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    # Exponential backoff with jitter: ~base, ~2x base, ~4x base, ... capped at max_delay
+    return min(max_delay, base_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+def _retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
+
+def _is_retryable(method: str, response: httpx.Response) -> bool:
+    if response.status_code in RETRYABLE_STATUS_CODES:
+        return response.status_code < 500 or method.upper() in IDEMPOTENT_METHODS
+    # GitHub signals secondary rate limits as 403 + Retry-After
+    return response.status_code == 403 and "Retry-After" in response.headers
+
+async def send_with_retry(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    *,
+    attempts: int = 3,
+    base_delay: float = 0.5,
+    max_delay: float = 8.0,
+    **kwargs: Any,
+) -> httpx.Response:
+    """
+    Sends a request, retrying connection failures and retryable statuses with
+    exponential backoff and jitter. A Retry-After header is honoured when it fits
+    within `max_delay`; longer waits are left to the caller. Gateway errors are
+    only retried for idempotent methods; other methods get rate limits and
+    connection failures retried, both of which mean the request wasn't applied.
+
+    Returns the final response without raising for its status.
+    """
+    attempt = 1
+    while True:
+        try:
+            response = await client.request(method, url, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            if attempt >= attempts:
+                raise
+            delay = _backoff_delay(attempt, base_delay, max_delay)
+            logger.warning(f"{method} {url} failed ({e!r}), retrying in {delay:.2f}s")
+        else:
+            if attempt >= attempts or not _is_retryable(method, response):
+                return response
+            delay = _retry_after_seconds(response)
+            if delay is None:
+                delay = _backoff_delay(attempt, base_delay, max_delay)
+            elif delay > max_delay:
+                return response
+            logger.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.2f}s")
+
+        await asyncio.sleep(delay)
+        attempt += 1
+
+# Global instance to access the shared HTTP client
+http_client = HTTPClientManager()
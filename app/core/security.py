@@ -1,8 +1,11 @@
+import hashlib
+import time
 from typing import Optional
 from jose import jwt, JWTError
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
+from app.core.cache import TTLCache
 from app.core.config import settings
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
@@ -11,7 +14,16 @@ class TokenData(BaseModel):
     id: Optional[str] = None
     email: Optional[str] = None
 
+# Verified tokens keyed by a digest of the raw token. Entries never outlive the token's `exp`.
+_TOKEN_CACHE_TTL = 60
+_token_cache = TTLCache(maxsize=10_000, ttl=_TOKEN_CACHE_TTL)
+
 def verify_token(token: str) -> TokenData:
+    cache_key = hashlib.blake2s(token.encode(), digest_size=16).digest()
+    cached = _token_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
         # Supabase signs JWTs with the project's JWT Secret
         payload = jwt.decode(
@@ -28,7 +40,7 @@ def verify_token(token: str) -> TokenData:
                 detail="Could not validate credentials",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        return TokenData(id=user_id, email=email)
+        token_data = TokenData(id=user_id, email=email)
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -36,5 +48,13 @@ def verify_token(token: str) -> TokenData:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    ttl = _TOKEN_CACHE_TTL
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)):
+        ttl = min(ttl, exp - time.time())
+    if ttl > 0:
+        _token_cache.set(cache_key, token_data, ttl=ttl)
+    return token_data
+
 def get_current_user(token: str = Depends(oauth2_scheme)) -> TokenData:
     return verify_token(token)
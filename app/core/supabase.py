@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from typing import Optional
 from supabase import create_async_client, AsyncClient
@@ -8,15 +9,21 @@ logger = logging.getLogger(__name__)
 class SupabaseManager:
     client: Optional[AsyncClient] = None
     service_client: Optional[AsyncClient] = None
+    # Separate locks: get_service_client may fall back to get_client while holding its own
+    _client_lock: asyncio.Lock = asyncio.Lock()
+    _service_client_lock: asyncio.Lock = asyncio.Lock()
 
     @classmethod
     async def get_client(cls) -> AsyncClient:
         if cls.client is None:
-            url: str = settings.SUPABASE_URL
-            key: str = settings.SUPABASE_KEY
-            if not url or not key:
-                raise ValueError("Supabase URL and Key must be provided in the environment variables.")
-            cls.client = await create_async_client(url, key)
+            async with cls._client_lock:
+                # Re-check: another coroutine may have created it while we waited
+                if cls.client is None:
+                    url: str = settings.SUPABASE_URL
+                    key: str = settings.SUPABASE_KEY
+                    if not url or not key:
+                        raise ValueError("Supabase URL and Key must be provided in the environment variables.")
+                    cls.client = await create_async_client(url, key)
         return cls.client
 
     @classmethod
@@ -26,15 +33,17 @@ class SupabaseManager:
         Falls back to the standard client (SUPABASE_KEY) if not.
         """
         if cls.service_client is None:
-            url: str = settings.SUPABASE_URL
-            key: Optional[str] = settings.SUPABASE_SERVICE_ROLE_KEY
+            async with cls._service_client_lock:
+                if cls.service_client is None:
+                    url: str = settings.SUPABASE_URL
+                    key: Optional[str] = settings.SUPABASE_SERVICE_ROLE_KEY
 
-            if key:
-                logger.info("Initializing Supabase client with Service Role Key.")
-                cls.service_client = await create_async_client(url, key)
-            else:
-                logger.warning("SUPABASE_SERVICE_ROLE_KEY not found. Falling back to standard SUPABASE_KEY. RLS might block access.")
-                return await cls.get_client()
+                    if key:
+                        logger.info("Initializing Supabase client with Service Role Key.")
+                        cls.service_client = await create_async_client(url, key)
+                    else:
+                        logger.warning("SUPABASE_SERVICE_ROLE_KEY not found. Falling back to standard SUPABASE_KEY. RLS might block access.")
+                        cls.service_client = await cls.get_client()
 
         return cls.service_client
 
@@ -1,11 +1,12 @@
 import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.api.api import api_router
 from app.core.supabase import db
+from app.core.http import http_client
+from app.core.responses import ORJSONResponse
 
 # Logging Configuration
 logging.basicConfig(
@@ -16,14 +17,18 @@ logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Initialize Supabase Client
+    # Initialize Supabase Clients so the first requests don't pay the setup cost
     try:
         await db.get_client()
-        logger.info("Supabase client initialized.")
+        await db.get_service_client()
+        logger.info("Supabase clients initialized.")
     except Exception as e:
-        logger.error(f"Failed to initialize Supabase client: {e}")
+        logger.error(f"Failed to initialize Supabase clients: {e}")
+    # Open the shared outbound HTTP pool up front (GitHub API, raw score/test JSON)
+    await http_client.get_client()
     yield
-    # Clean up resources if needed
+    # Clean up resources
+    await http_client.close()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -46,7 +51,7 @@ if settings.BACKEND_CORS_ORIGINS:
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Global exception: {exc}")
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={"message": "Internal Server Error", "detail": str(exc)},
     )
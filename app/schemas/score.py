@@ -1,5 +1,13 @@
-from pydantic import BaseModel
+from typing import Dict, List
+from pydantic import BaseModel, Field
 
 class ScoreResponse(BaseModel):
     student_test_id: str
     github_url: str
+
+class ScoreBatchRequest(BaseModel):
+    student_test_ids: List[str] = Field(..., min_length=1, max_length=50)
+
+class ScoreBatchResponse(BaseModel):
+    results: List[ScoreResponse]
+    errors: Dict[str, str] = {}
@@ -1,30 +1,146 @@
-import json
+import asyncio
+import hashlib
 import logging
 import base64
-import httpx
-from datetime import datetime
+import orjson
+from datetime import datetime, timezone
+from functools import cached_property, lru_cache
 from typing import Dict, Any, List, Optional
 
+from postgrest import ReturnMethod
+from app.core.batching import KeyedCoalescer
+from app.core.cache import TTLCache
 from app.core.config import settings
+from app.core.http import http_client, send_with_retry
 from app.core.supabase import db
 
 logger = logging.getLogger(__name__)
 
+# filename -> (sha, parsed content, encoded size) of history files this process last wrote.
+# Lets repeat users skip the GitHub GET; a stale SHA is detected on PUT and resynced.
+_github_file_cache = TTLCache(maxsize=2048, ttl=600)
+
+# test_attempt_id -> (digest of its score data, result) for recently processed attempts.
+# A retried attempt with unchanged scores returns the earlier result instead of
+# counting the attempt twice and appending a duplicate history entry.
+_processed_attempts = TTLCache(maxsize=4096, ttl=3600)
+
+# The parts of the score data process_test_attempt reads. Only these are hashed;
+# attempt_comparison and metadata_stats make up most of the result and don't
+# affect analytics.
+_DIGEST_FIELDS = ("sections", "section_scores", "chapter_scores", "total_stats")
+
+def _score_digest(score_data: Dict[str, Any]) -> bytes:
+    # Non-str keys are stringified, so freshly computed scores and the same scores
+    # read back from result_url produce the same digest
+    consumed = [score_data.get(field) for field in _DIGEST_FIELDS]
+    raw = orjson.dumps(consumed, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+def _cached_result(test_attempt_id: str, digest: bytes) -> Optional[Dict[str, Any]]:
+    cached = _processed_attempts.get(test_attempt_id)
+    if cached is not None and cached[0] == digest:
+        logger.info(f"Test attempt {test_attempt_id} already processed with the same scores, skipping")
+        return dict(cached[1])
+    return None
+
+# GitHub files whose base64 content is larger than this are decoded/encoded in a worker
+# thread; below it orjson finishes faster than a thread hand-off would cost
+_OFFLOAD_THRESHOLD_BYTES = 256 * 1024
+
+def _decode_github_content(content_encoded: str) -> Any:
+    return orjson.loads(base64.b64decode(content_encoded))
+
+def _encode_github_content(data: Any) -> str:
+    # Chapter scores can be keyed by None or a number (a question with no chapter
+    # tag); these are written as strings, e.g. "null", as json.dumps would
+    return base64.b64encode(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)).decode("ascii")
+
+async def _run_codec(size: int, func, arg: Any) -> Any:
+    if size > _OFFLOAD_THRESHOLD_BYTES:
+        return await asyncio.to_thread(func, arg)
+    return func(arg)
+
+# Caps concurrent GitHub contents writes. /scores/batch runs analytics for up to 50
+# users side by side, which would otherwise trip GitHub's secondary rate limits.
+_GITHUB_WRITE_CONCURRENCY = 8
+_github_write_semaphore = asyncio.Semaphore(_GITHUB_WRITE_CONCURRENCY)
+
+# Columns of user_analytics read back to accumulate the running totals
+_ANALYTICS_COLUMNS = "attempt_no,phy_avg,chem_avg,math_avg,botany_avg,zoo_avg,accuracy,percentile"
+
+# Keyword in a NEET section name -> subject bucket, checked in order
+_NEET_SUBJECT_KEYWORDS = (
+    ("physics", "phy"),
+    ("chemistry", "chem"),
+    ("botany", "botany"),
+    ("zoology", "zoo"),
+)
+
+@lru_cache(maxsize=256)
+def _neet_subject(section_name: str) -> Optional[str]:
+    """
+    Maps a section name to its NEET subject bucket. Papers reuse the same few
+    section names, so the result is cached.
+    """
+    name_lower = section_name.lower()
+    for keyword, subject in _NEET_SUBJECT_KEYWORDS:
+        if keyword in name_lower:
+            return subject
+    return None
+
 class AnalyticsService:
+    def __init__(self):
+        # Writes to one user's history file run one at a time. An entry is written
+        # immediately when its file is idle; entries that arrive while a write is in
+        # flight are appended together by the next write.
+        self._history_writer: KeyedCoalescer[str, Dict[str, Any], str] = KeyedCoalescer(
+            self._write_history
+        )
+
+    @cached_property
+    def _github_headers(self) -> Dict[str, str]:
+        # Settings are fixed for the process lifetime, so the headers are built once
+        return {
+            "Authorization": f"Bearer {settings.GITHUB_TOKEN}",
+            "Accept": "application/vnd.github.v3+json",
+            "X-GitHub-Api-Version": "2022-11-28"
+        }
+
+    @cached_property
+    def _github_put_headers(self) -> Dict[str, str]:
+        return {**self._github_headers, "Content-Type": "application/json"}
+
+    async def _fetch_score_data(self, result_url: str) -> Dict[str, Any]:
+        client = await http_client.get_client()
+        score_response = await send_with_retry(client, "GET", result_url)
+        score_response.raise_for_status()
+        return orjson.loads(score_response.content)
+
     async def process_test_attempt(self, test_attempt_id: str, score_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Processes a test attempt to update user analytics.
         """
         logger.info(f"Processing test attempt: {test_attempt_id}")
 
+        digest = None
+        if score_data:
+            digest = _score_digest(score_data)
+            cached = _cached_result(test_attempt_id, digest)
+            if cached is not None:
+                return cached
+
         # 1. Fetch student_test record
         supabase = await db.get_service_client()
-        response = await supabase.table("student_tests").select("*").eq("id", test_attempt_id).execute()
+        student_response = await (
+            supabase.table("student_tests").select("user_id,test_id,result_url").eq("id", test_attempt_id).maybe_single().execute()
+        )
+        # maybe_single() yields no response at all when the row is missing
+        student_test = student_response.data if student_response else None
 
-        if not response.data:
+        if not student_test:
             raise ValueError(f"Student test not found for id: {test_attempt_id}")
 
-        student_test = response.data[0]
         result_url = student_test.get("result_url")
         user_id = student_test.get("user_id")
         test_id = student_test.get("test_id")
@@ -35,21 +151,31 @@ class AnalyticsService:
         if not user_id:
              raise ValueError(f"User ID not found for test attempt: {test_attempt_id}")
 
-        # 2. Fetch Test details (for 99ile)
-        tests_response = await supabase.table("tests").select("*").eq("testID", test_id).execute()
+        # 2-3. Fetch Test details (for 99ile), the user's current analytics row and the
+        # score JSON (unless passed in). They only depend on the student_test row, so
+        # they run concurrently.
+        tests_query = supabase.table("tests").select("99ile").eq("testID", test_id).maybe_single().execute()
+        analytics_query = (
+            supabase.table("user_analytics").select(_ANALYTICS_COLUMNS).eq("user_id", user_id).maybe_single().execute()
+        )
+        if score_data:
+            tests_response, analytics_response = await asyncio.gather(tests_query, analytics_query)
+        else:
+            tests_response, analytics_response, score_data = await asyncio.gather(
+                tests_query, analytics_query, self._fetch_score_data(result_url)
+            )
+            digest = _score_digest(score_data)
+            cached = _cached_result(test_attempt_id, digest)
+            if cached is not None:
+                return cached
+
+        # maybe_single() yields no response at all when the row is missing
         test_data = {}
-        if tests_response.data:
-            test_data = tests_response.data[0]
+        if tests_response and tests_response.data:
+            test_data = tests_response.data
 
         m99 = test_data.get("99ile") or 0
 
-        # 3. Fetch Score JSON
-        if not score_data:
-            async with httpx.AsyncClient() as client:
-                score_response = await client.get(result_url)
-                score_response.raise_for_status()
-                score_data = score_response.json()
-
         # 4. Process Scores
         section_scores = score_data.get("section_scores", {})
         total_stats = score_data.get("total_stats", {})
@@ -74,8 +200,7 @@ class AnalyticsService:
         # Detect exam type by section names to correctly bucket subject scores.
         # NEET pattern: sections contain Botany/Zoology
         # JEE pattern:  sections contain Math/Mathematics
-        all_section_names_lower = [s.lower() for s in ordered_section_names if s]
-        is_neet = any("botany" in s or "zoology" in s for s in all_section_names_lower)
+        is_neet = any(_neet_subject(s) in ("botany", "zoo") for s in ordered_section_names if s)
         exam_type = "NEET" if is_neet else "JEE"
 
         phy_score = 0.0
@@ -84,31 +209,33 @@ class AnalyticsService:
         botany_score = 0.0
         zoo_score = 0.0
 
-        if is_neet:
+        # Bound once for the loops below
+        section_stats = section_scores.get
+
+        if not section_scores:
+            logger.warning(f"No section scores in score data for attempt {test_attempt_id}, subject scores stay at 0")
+        elif is_neet:
             # NEET: map by section name keyword
+            neet_scores = {"phy": 0.0, "chem": 0.0, "botany": 0.0, "zoo": 0.0}
             for section_name in ordered_section_names:
-                score = section_scores.get(section_name, {}).get("score", 0)
-                name_lower = (section_name or "").lower()
-                if "physics" in name_lower:
-                    phy_score += score
-                elif "chemistry" in name_lower:
-                    chem_score += score
-                elif "botany" in name_lower:
-                    botany_score += score
-                elif "zoology" in name_lower:
-                    zoo_score += score
-                else:
+                subject = _neet_subject(section_name or "")
+                if subject is None:
                     logger.warning(f"Unrecognised NEET section name: '{section_name}', skipping")
+                    continue
+                stats = section_stats(section_name)
+                if stats:
+                    neet_scores[subject] += stats.get("score", 0)
+
+            phy_score = neet_scores["phy"]
+            chem_score = neet_scores["chem"]
+            botany_score = neet_scores["botany"]
+            zoo_score = neet_scores["zoo"]
         else:
             # JEE: positional grouping — first 2 Physics, next 2 Chemistry, next 2 Math
-            for i, section_name in enumerate(ordered_section_names):
-                score = section_scores.get(section_name, {}).get("score", 0)
-                if i < 2:
-                    phy_score += score
-                elif i < 4:
-                    chem_score += score
-                elif i < 6:
-                    math_score += score
+            jee_scores = [(section_stats(section_name) or {}).get("score", 0) for section_name in ordered_section_names[:6]]
+            phy_score += sum(jee_scores[0:2])
+            chem_score += sum(jee_scores[2:4])
+            math_score += sum(jee_scores[4:6])
 
         # Calculate accuracy
         total_attempted = total_stats.get("total_attempted", 0)
@@ -136,12 +263,10 @@ class AnalyticsService:
         # Round percentile to integer for storage (assuming similar requirement as accuracy)
         percentile_int = int(round(percentile))
 
-        # 5. Update user_analytics
-        analytics_response = await supabase.table("user_analytics").select("*").eq("user_id", user_id).execute()
-
+        # 5. Accumulate running totals
         current_data = {}
-        if analytics_response.data:
-            current_data = analytics_response.data[0]
+        if analytics_response and analytics_response.data:
+            current_data = analytics_response.data
 
         new_attempt_no = (current_data.get("attempt_no") or 0) + 1
 
@@ -164,39 +289,12 @@ class AnalyticsService:
         new_accuracy = int(current_accuracy + accuracy_int)
         new_percentile_sum = int(current_percentile + percentile_int)
 
-        analytics_update = {
-            "user_id": user_id,
-            "exam_type": exam_type,
-            "attempt_no": new_attempt_no,
-            "phy_avg": new_phy_avg,
-            "chem_avg": new_chem_avg,
-            "math_avg": new_math_avg,
-            "botany_avg": new_botany_avg,
-            "zoo_avg": new_zoo_avg,
-            "accuracy": new_accuracy,
-            "percentile": new_percentile_sum
-            # history_url will be updated later
-        }
-
-        if not analytics_response.data:
-            # Create new row
-            # We insert first to ensure row exists (and get other defaults if any)
-            # Actually UPSERT is better if supported, but let's stick to Insert or Update
-            insert_res = await supabase.table("user_analytics").insert(analytics_update).execute()
-            if not insert_res.data:
-                raise ValueError("Failed to create user_analytics row")
-            analytics_record = insert_res.data[0]
-        else:
-            # Update existing row
-            update_res = await supabase.table("user_analytics").update(analytics_update).eq("user_id", user_id).execute()
-            if not update_res.data:
-                 raise ValueError("Failed to update user_analytics row")
-            analytics_record = update_res.data[0]
-
         # 6. History JSON
+        # One timestamp for both files written for this attempt
+        now_iso = datetime.now(timezone.utc).isoformat()
         history_entry = {
             "test_attempt_id": test_attempt_id,
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": now_iso,
             "phy_score": phy_score,
             "chem_score": chem_score,
             "math_score": math_score,
@@ -206,168 +304,187 @@ class AnalyticsService:
             "percentile": percentile
         }
 
-        # Fetch existing history if history_url exists
-        history_data = []
-        current_history_url = analytics_record.get("history_url")
-
-        # If we have a URL, try to fetch it.
-        # But actually, we are supposed to "create/update a JSON for the user_id that is being handled"
-        # The file location is user_analytics/{user_id}.json
-        # We can try to fetch it from GitHub API directly to ensure we have the latest,
-        # or relying on history_url is fine if we trust it points to the right place.
-        # However, to use the GitHub API correctly for updates (handling SHA), we should fetch via API anyway.
-
+        # The file location is user_analytics/{user_id}.json. It is read through the
+        # GitHub API rather than history_url so the update has the current SHA.
         filename = f"user_analytics/{user_id}.json"
 
-        # We need to fetch the existing content to append.
-        # I'll use a helper method similar to ScoreService.push_to_github but one that reads first.
-
-        new_history_url = await self._update_github_history(filename, history_entry)
-
-        # 6. Chapter Stats JSON
+        # 7. Chapter Stats JSON
         chapter_scores = score_data.get("chapter_scores", {})
-        current_chapter_url = analytics_record.get("chapter_url")
 
-        new_chapter_url = await self._update_chapter_stats(user_id, chapter_scores)
+        async def update_chapter_stats() -> str:
+            async with _github_write_semaphore:
+                return await self._update_chapter_stats(user_id, chapter_scores, now_iso)
+
+        # The two files are independent, so write them concurrently. Both happen before
+        # the analytics row so their URLs go out in the same upsert.
+        new_history_url, new_chapter_url = await asyncio.gather(
+            self._history_writer.submit(filename, history_entry),
+            update_chapter_stats(),
+        )
 
-        # 7. Update URLs in DB
-        update_payload = {}
-        if new_history_url != current_history_url:
-            update_payload["history_url"] = new_history_url
-        if new_chapter_url != current_chapter_url:
-            update_payload["chapter_url"] = new_chapter_url
+        # 8. Update user_analytics
+        analytics_update = {
+            "user_id": user_id,
+            "exam_type": exam_type,
+            "attempt_no": new_attempt_no,
+            "phy_avg": new_phy_avg,
+            "chem_avg": new_chem_avg,
+            "math_avg": new_math_avg,
+            "botany_avg": new_botany_avg,
+            "zoo_avg": new_zoo_avg,
+            "accuracy": new_accuracy,
+            "percentile": new_percentile_sum,
+            "history_url": new_history_url,
+            "chapter_url": new_chapter_url
+        }
 
-        if update_payload:
-            await supabase.table("user_analytics").update(update_payload).eq("user_id", user_id).execute()
+        # Single round trip for both new and returning users; the unique user_id
+        # constraint also stops two concurrent first attempts from inserting twice.
+        await supabase.table("user_analytics").upsert(
+            analytics_update, on_conflict="user_id", returning=ReturnMethod.minimal
+        ).execute()
 
-        return {
+        result = {
             "message": "Analytics updated successfully",
             "user_id": user_id,
             "exam_type": exam_type,
             "history_url": new_history_url,
             "chapter_url": new_chapter_url
         }
+        _processed_attempts.set(test_attempt_id, (digest, result))
+        return dict(result)
 
-    async def _update_chapter_stats(self, user_id: str, new_chapter_scores: Dict[str, Any]) -> str:
+    async def _update_chapter_stats(self, user_id: str, new_chapter_scores: Dict[str, Any], updated_at: str) -> str:
         filename = f"user_analytics/chapters/{user_id}.json"
 
         if not settings.GITHUB_TOKEN or not settings.GITHUB_REPO:
             raise ValueError("GITHUB_TOKEN and GITHUB_REPO must be set in configuration")
 
         base_url = f"https://api.github.com/repos/{settings.GITHUB_REPO}/contents/{filename}"
-        headers = {
-            "Authorization": f"Bearer {settings.GITHUB_TOKEN}",
-            "Accept": "application/vnd.github.v3+json",
-            "X-GitHub-Api-Version": "2022-11-28"
+        headers = self._github_headers
+
+        client = await http_client.get_client()
+        # 1. Fetch existing stats
+        stats_data = {"chapters": {}, "last_updated": ""}
+        sha = None
+        content_size = 0
+
+        try:
+            get_response = await send_with_retry(client, "GET", base_url, headers=headers)
+            if get_response.status_code == 200:
+                data = orjson.loads(get_response.content)
+                sha = data.get("sha")
+                content_encoded = data.get("content")
+                if content_encoded:
+                    content_size = len(content_encoded)
+                    stats_data = await _run_codec(content_size, _decode_github_content, content_encoded)
+        except Exception as e:
+            logger.info(f"Chapter stats file {filename} likely does not exist or empty: {e}")
+
+        chapters = stats_data.get("chapters", {})
+        if not isinstance(chapters, dict):
+            chapters = {}
+
+        # 2. Update with new scores
+        for chapter_code, scores in new_chapter_scores.items():
+            if chapter_code not in chapters:
+                chapters[chapter_code] = {
+                    "attempted": 0,
+                    "unattempted": 0,
+                    "correct": 0,
+                    "incorrect": 0,
+                    "total_questions": 0
+                }
+
+            entry = chapters[chapter_code]
+
+            c_correct = scores.get("correct", 0)
+            c_incorrect = scores.get("incorrect", 0)
+            c_unattempted = scores.get("unattempted", 0)
+            c_total = scores.get("total_questions", 0)
+
+            entry["correct"] += c_correct
+            entry["incorrect"] += c_incorrect
+            entry["unattempted"] += c_unattempted
+            entry["total_questions"] += c_total
+            entry["attempted"] += (c_correct + c_incorrect)
+
+        # 3. Sort: least attempted at the top
+        # Only this attempt's chapters changed, so the stored order is often still
+        # correct; rebuild the dict only when a count actually moved out of order.
+        attempted = [entry.get("attempted", 0) for entry in chapters.values()]
+        if any(prev > nxt for prev, nxt in zip(attempted, attempted[1:])):
+            chapters = dict(sorted(chapters.items(), key=lambda item: item[1].get("attempted", 0)))
+
+        stats_data["chapters"] = chapters
+        stats_data["last_updated"] = updated_at
+
+        # 4. Push to GitHub
+        # The stats grow by at most a few chapters per attempt, so the old size is a good guide
+        content_encoded = await _run_codec(content_size, _encode_github_content, stats_data)
+
+        message = f"Update chapter stats for {user_id}"
+
+        payload = {
+            "message": message,
+            "content": content_encoded
         }
+        if sha:
+            payload["sha"] = sha
 
-        async with httpx.AsyncClient() as client:
-            # 1. Fetch existing stats
-            stats_data = {"chapters": {}, "last_updated": ""}
-            sha = None
-
-            try:
-                get_response = await client.get(base_url, headers=headers)
-                if get_response.status_code == 200:
-                    data = get_response.json()
-                    sha = data.get("sha")
-                    content_encoded = data.get("content")
-                    if content_encoded:
-                        content_str = base64.b64decode(content_encoded).decode("utf-8")
-                        stats_data = json.loads(content_str)
-            except Exception as e:
-                logger.info(f"Chapter stats file {filename} likely does not exist or empty: {e}")
-
-            chapters = stats_data.get("chapters", {})
-            if not isinstance(chapters, dict):
-                chapters = {}
-
-            # 2. Update with new scores
-            for chapter_code, scores in new_chapter_scores.items():
-                if chapter_code not in chapters:
-                    chapters[chapter_code] = {
-                        "attempted": 0,
-                        "unattempted": 0,
-                        "correct": 0,
-                        "incorrect": 0,
-                        "total_questions": 0
-                    }
-
-                entry = chapters[chapter_code]
-
-                c_correct = scores.get("correct", 0)
-                c_incorrect = scores.get("incorrect", 0)
-                c_unattempted = scores.get("unattempted", 0)
-                c_total = scores.get("total_questions", 0)
-
-                entry["correct"] += c_correct
-                entry["incorrect"] += c_incorrect
-                entry["unattempted"] += c_unattempted
-                entry["total_questions"] += c_total
-                entry["attempted"] += (c_correct + c_incorrect)
-
-            # 3. Sort: least attempted at the top
-            sorted_chapters = dict(sorted(chapters.items(), key=lambda item: item[1].get("attempted", 0)))
-
-            stats_data["chapters"] = sorted_chapters
-            stats_data["last_updated"] = datetime.utcnow().isoformat()
-
-            # 4. Push to GitHub
-            content_str = json.dumps(stats_data, indent=4)
-            content_encoded = base64.b64encode(content_str.encode("utf-8")).decode("utf-8")
-
-            message = f"Update chapter stats for {user_id}"
-
-            payload = {
-                "message": message,
-                "content": content_encoded
-            }
-            if sha:
-                payload["sha"] = sha
+        put_response = await send_with_retry(
+            client, "PUT", base_url, headers=self._github_put_headers, content=orjson.dumps(payload)
+        )
+        put_response.raise_for_status()
 
-            put_response = await client.put(base_url, headers=headers, json=payload)
-            put_response.raise_for_status()
+        resp_data = orjson.loads(put_response.content)
+        return resp_data.get("content", {}).get("download_url")
 
-            resp_data = put_response.json()
-            return resp_data.get("content", {}).get("download_url")
+    async def _write_history(self, filename: str, entries: List[Dict[str, Any]]) -> str:
+        async with _github_write_semaphore:
+            return await self._update_github_history(filename, entries)
 
-    async def _update_github_history(self, filename: str, new_entry: Dict) -> str:
+    async def _update_github_history(self, filename: str, new_entries: List[Dict[str, Any]]) -> str:
         if not settings.GITHUB_TOKEN or not settings.GITHUB_REPO:
             raise ValueError("GITHUB_TOKEN and GITHUB_REPO must be set in configuration")
 
         base_url = f"https://api.github.com/repos/{settings.GITHUB_REPO}/contents/{filename}"
-        headers = {
-            "Authorization": f"Bearer {settings.GITHUB_TOKEN}",
-            "Accept": "application/vnd.github.v3+json",
-            "X-GitHub-Api-Version": "2022-11-28"
-        }
+        headers = self._github_headers
+        put_headers = self._github_put_headers
+
+        client = await http_client.get_client()
+        cached = _github_file_cache.get(filename)
 
-        async with httpx.AsyncClient() as client:
-            # 1. Get existing file
+        for _ in range(2):
+            # 1. Get existing file (skipped when this process wrote the latest version)
             sha = None
             history_list = []
-
-            try:
-                get_response = await client.get(base_url, headers=headers)
-                if get_response.status_code == 200:
-                    data = get_response.json()
-                    sha = data.get("sha")
-                    content_encoded = data.get("content")
-                    if content_encoded:
-                        content_str = base64.b64decode(content_encoded).decode("utf-8")
-                        history_list = json.loads(content_str)
-            except Exception as e:
-                logger.info(f"File {filename} likely does not exist or empty: {e}")
+            content_size = 0
+
+            if cached is not None:
+                sha, history_list, content_size = cached[0], list(cached[1]), cached[2]
+            else:
+                try:
+                    get_response = await send_with_retry(client, "GET", base_url, headers=headers)
+                    if get_response.status_code == 200:
+                        data = orjson.loads(get_response.content)
+                        sha = data.get("sha")
+                        content_encoded = data.get("content")
+                        if content_encoded:
+                            content_size = len(content_encoded)
+                            history_list = await _run_codec(content_size, _decode_github_content, content_encoded)
+                except Exception as e:
+                    logger.info(f"File {filename} likely does not exist or empty: {e}")
 
             if not isinstance(history_list, list):
                 history_list = []
 
-            # 2. Append new entry
-            history_list.append(new_entry)
+            # 2. Append new entries
+            history_list.extend(new_entries)
 
             # 3. Push back
-            content_str = json.dumps(history_list, indent=4)
-            content_encoded = base64.b64encode(content_str.encode("utf-8")).decode("utf-8")
+            # The history grows with every attempt; large files are encoded off the event loop
+            content_encoded = await _run_codec(content_size, _encode_github_content, history_list)
 
             message = f"Update user analytics history for {filename}"
 
@@ -378,10 +495,25 @@ class AnalyticsService:
             if sha:
                 payload["sha"] = sha
 
-            put_response = await client.put(base_url, headers=headers, json=payload)
-            put_response.raise_for_status()
-
-            resp_data = put_response.json()
-            return resp_data.get("content", {}).get("download_url")
+            # Encode the request body with orjson too; httpx's json= would run the
+            # (large) base64 string through the stdlib encoder
+            put_response = await send_with_retry(
+                client, "PUT", base_url, headers=put_headers, content=orjson.dumps(payload)
+            )
+
+            if cached is not None and put_response.status_code in (409, 422):
+                # Someone else (another worker) updated the file since we cached it
+                logger.info(f"Cached SHA for {filename} is stale, re-reading from GitHub")
+                _github_file_cache.pop(filename)
+                cached = None
+                continue
+            break
+
+        put_response.raise_for_status()
+
+        content = orjson.loads(put_response.content).get("content") or {}
+        if content.get("sha"):
+            _github_file_cache.set(filename, (content["sha"], history_list, len(content_encoded)))
+        return content.get("download_url")
 
 analytics_service = AnalyticsService()
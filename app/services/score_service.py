@@ -1,45 +1,122 @@
-import json
 import logging
 import base64
-import httpx
+import orjson
+from collections import Counter
+from functools import cached_property, lru_cache
 from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 from app.core.config import settings
+from app.core.http import http_client, send_with_retry
 
 logger = logging.getLogger(__name__)
 
+class PreparedPaper(NamedTuple):
+    """
+    The parts of a paper that are the same for every submission, resolved once
+    so the per-question scoring loop only deals with the student's answers.
+    """
+    # Section name -> (positive, negative) marks
+    sections: Dict[Any, Tuple[Any, Any]]
+    # Chapter tags in first-seen order
+    chapter_tags: List[Any]
+    # (question, uuid, section name, chapter tag, section index, chapter index,
+    #  positive marks, negative marks, correct answer normalised for comparison).
+    # Indices point into `sections`/`chapter_tags`; questions whose section isn't
+    # configured get index len(sections), a bucket that is never reported.
+    questions: List[tuple]
+    # Per-question metadata columns, in question order: one list of stringified
+    # values (None when missing) per _METADATA_FIELDS entry, the metadata_stats
+    # topic keys each question's topicTags resolve to, and whether each question
+    # is easy (an incorrect answer to it is a blunder)
+    metadata: Tuple[List[Optional[str]], ...]
+    topics: List[Tuple[str, ...]]
+    easy: List[bool]
+
+# Status codes index the aggregator rows and metadata bins below
+_CORRECT, _INCORRECT, _UNATTEMPTED = 0, 1, 2
+_STATUS_NAMES = ('Correct', 'Incorrect', 'Unattempted')
+_METADATA_BINS = ('correct', 'incorrect', 'unattempted')
+# metadata_stats field -> question key it counts
+_METADATA_FIELDS = (
+    ('difficulty', 'difficulty'),
+    ('relevance', 'jeeMainsRelevance'),
+    ('scary', 'scary'),  # Scary/Calculation
+    ('lengthy', 'lengthy'),
+)
+
+def _score_row_to_dict(row: list) -> dict:
+    score, correct, incorrect, unattempted, total_questions = row
+    return {
+        'score': score,
+        'correct': correct,
+        'incorrect': incorrect,
+        'unattempted': unattempted,
+        'total_questions': total_questions
+    }
+
+def _count_metadata(paper: PreparedPaper, indices: List[int]) -> Dict[str, Dict[str, int]]:
+    """
+    Counts the paper's metadata values and topics over the questions at `indices`
+    (one status bin), in first-seen order.
+    """
+    stats = {}
+    for (field, _), column in zip(_METADATA_FIELDS, paper.metadata):
+        counts = Counter([column[i] for i in indices])
+        counts.pop(None, None)
+        stats[field] = dict(counts)
+
+    # Topics
+    topics = paper.topics
+    stats['topics'] = dict(Counter([key for i in indices for key in topics[i]]))
+    return stats
+
+@lru_cache(maxsize=None)
+def _load_topic_keys() -> Dict[Tuple[str, str], str]:
+    """
+    Reads chapters.json once per process and returns the (chapter code, topic id)
+    -> metadata_stats topic key lookup for every named topic. The lookup is shared
+    by all ScoreService instances and read-only.
+    """
+    try:
+        # Assuming chapters.json is in the root directory
+        # app/services/score_service.py -> app/services/ -> app/ -> root/
+        base_path = Path(__file__).resolve().parent.parent.parent
+        chapters_path = base_path / 'chapters.json'
+        if not chapters_path.exists():
+            logger.warning(f"chapters.json not found at {chapters_path}")
+            return {}
+
+        data = orjson.loads(chapters_path.read_bytes())
+
+        mapping = {}
+        for subject, chapters in data.items():
+            for chapter in chapters:
+                code = chapter.get('code')
+                topics = chapter.get('topics', {})
+                if code:
+                    mapping[code] = topics
+    except Exception as e:
+        logger.error(f"Error loading chapters.json: {e}")
+        return {}
+
+    topic_keys = {
+        (code, str(t_id)): f"{code}-{t_id}"
+        for code, topics in mapping.items()
+        for t_id, t_name in (topics or {}).items()
+        if t_name
+    }
+    return topic_keys
+
 class ScoreService:
     def __init__(self):
-        self.chapter_topics_map = self._load_chapter_topics()
-
-    def _load_chapter_topics(self):
-        try:
-            # Assuming chapters.json is in the root directory
-            # app/services/score_service.py -> app/services/ -> app/ -> root/
-            base_path = Path(__file__).resolve().parent.parent.parent
-            chapters_path = base_path / 'chapters.json'
-            if not chapters_path.exists():
-                logger.warning(f"chapters.json not found at {chapters_path}")
-                return {}
-
-            with open(chapters_path, 'r') as f:
-                data = json.load(f)
-
-            mapping = {}
-            for subject, chapters in data.items():
-                for chapter in chapters:
-                    code = chapter.get('code')
-                    topics = chapter.get('topics', {})
-                    if code:
-                        mapping[code] = topics
-            return mapping
-        except Exception as e:
-            logger.error(f"Error loading chapters.json: {e}")
-            return {}
+        self.topic_keys = _load_topic_keys()
 
-    def calculate_score(self, ppt_data: dict, response_data: dict) -> dict:
+    def prepare_paper(self, ppt_data: dict) -> PreparedPaper:
         """
-        Calculates scores based on the provided PPT data and user response data.
-        Refactored from calculate_scores.py.
+        Resolves everything calculate_score needs from the paper alone: marking
+        schemes, each question's section marks and chapter, and chapter order.
+        Callers scoring the same paper repeatedly can keep the result and pass it
+        to calculate_score.
         """
 
         # Process sections to get marking scheme
@@ -52,198 +129,153 @@ class ScoreService:
             if not negative_marks: # Handle if key is corrected in some jsons or missing
                  negative_marks = section.get('negativeMarksPerQuestion', 0)
 
-            sections_config[name] = {
-                'positive': positive_marks,
-                'negative': negative_marks
-            }
+            # (positive, negative) tuple: unpacked once per question in the loop below
+            sections_config[name] = (positive_marks, negative_marks)
 
-        attempt_comparison = []
-        section_scores = {}
-        chapter_scores = {}
-
-        # New metadata stats structure
-        metadata_stats = {
-            "correct": {
-                "difficulty": {},
-                "relevance": {},
-                "scary": {},
-                "lengthy": {},
-                "topics": {}
-            },
-            "incorrect": {
-                "difficulty": {},
-                "relevance": {},
-                "scary": {},
-                "lengthy": {},
-                "topics": {}
-            },
-            "unattempted": {
-                "difficulty": {},
-                "relevance": {},
-                "scary": {},
-                "lengthy": {},
-                "topics": {}
-            }
-        }
-
-        # Initialize score aggregators
-        for sec_name in sections_config:
-            section_scores[sec_name] = {
-                'score': 0,
-                'correct': 0,
-                'incorrect': 0,
-                'unattempted': 0,
-                'total_questions': 0
-            }
-
-        questions = ppt_data.get('questions', [])
-
-        # Total stats aggregators
-        total_score = 0
-        total_correct = 0
-        total_incorrect = 0
-        total_unattempted = 0
-        total_questions_count = 0
-
-        for q in questions:
-            uuid = q.get('uuid')
-            q_id = q.get('id')
+        get_section_cfg = sections_config.get
+        section_indices = {name: i for i, name in enumerate(sections_config)}
+        unknown_section = len(section_indices)
+        # Chapter tag -> index, in first-seen order
+        chapter_tags = {}
+        questions = []
+        for q in ppt_data.get('questions', []):
             section_name = q.get('section')
-            correct_ans = q.get('correctAnswer')
 
             # Get chapter from tag2 or chapterCode
             tags = q.get('tags', {})
             chapter_tag = q.get('chapterCode')
             if not chapter_tag:
                 chapter_tag = tags.get('tag2', 'Unknown')
-
-            user_ans = response_data.get(uuid)
-
-            status = 'Unattempted'
-            marks = 0
-
-            section_cfg = sections_config.get(section_name, {'positive': 0, 'negative': 0})
-
-            # Initialize chapter stats if needed
-            if chapter_tag not in chapter_scores:
-                chapter_scores[chapter_tag] = {
-                    'score': 0,
-                    'correct': 0,
-                    'incorrect': 0,
-                    'unattempted': 0,
-                    'total_questions': 0
-                }
-
-            # Update totals
-            if section_name in section_scores:
-                section_scores[section_name]['total_questions'] += 1
-            chapter_scores[chapter_tag]['total_questions'] += 1
-            total_questions_count += 1
-
-            if user_ans is not None:
-                # Check if answer is correct
-                # Normalize to string just in case
-                if str(user_ans).strip() == str(correct_ans).strip():
-                    status = 'Correct'
-                    marks = section_cfg['positive']
-                else:
-                    status = 'Incorrect'
-                    marks = section_cfg['negative']
+            chapter_idx = chapter_tags.setdefault(chapter_tag, len(chapter_tags))
+            section_idx = section_indices.get(section_name, unknown_section)
+
+            positive_marks, negative_marks = get_section_cfg(section_name, (0, 0))
+            # Normalize to string just in case; done once per paper rather than per submission
+            correct_norm = str(q.get('correctAnswer')).strip()
+            questions.append((
+                q, q.get('uuid'), section_name, chapter_tag, section_idx, chapter_idx,
+                positive_marks, negative_marks, correct_norm
+            ))
+
+        # Metadata columns, stringified once so each submission only counts them
+        raw_questions = [question[0] for question in questions]
+        metadata = tuple(
+            [None if val is None else str(val) for val in [q.get(question_key) for q in raw_questions]]
+            for _, question_key in _METADATA_FIELDS
+        )
+        get_topic_key = self.topic_keys.get
+        topics = []
+        for q, _, _, chapter_tag, *_ in questions:
+            # Check for topicTags (new format)
+            topic_tags = q.get('topicTags')
+            if topic_tags and isinstance(topic_tags, list):
+                keys = (get_topic_key((chapter_tag, str(t_id))) for t_id in topic_tags)
+                topics.append(tuple(key for key in keys if key))
             else:
-                status = 'Unattempted'
-                marks = 0
+                topics.append(())
+        easy = [str(q.get('difficulty', '')).strip().upper() == 'E' for q in raw_questions]
 
-            # Aggregate section stats
-            if section_name in section_scores:
-                section_scores[section_name]['score'] += marks
-                if status == 'Correct':
-                    section_scores[section_name]['correct'] += 1
-                elif status == 'Incorrect':
-                    section_scores[section_name]['incorrect'] += 1
-                else:
-                    section_scores[section_name]['unattempted'] += 1
-
-            # Aggregate chapter stats
-            chapter_scores[chapter_tag]['score'] += marks
-            if status == 'Correct':
-                chapter_scores[chapter_tag]['correct'] += 1
-            elif status == 'Incorrect':
-                chapter_scores[chapter_tag]['incorrect'] += 1
-            else:
-                chapter_scores[chapter_tag]['unattempted'] += 1
-
-            # Aggregate total stats
-            total_score += marks
-            if status == 'Correct':
-                total_correct += 1
-            elif status == 'Incorrect':
-                total_incorrect += 1
+        return PreparedPaper(sections_config, list(chapter_tags), questions, metadata, topics, easy)
+
+    def calculate_score(self, ppt_data: dict, response_data: dict, paper: Optional[PreparedPaper] = None) -> dict:
+        """
+        Calculates scores based on the provided PPT data and user response data.
+        Refactored from calculate_scores.py.
+
+        `paper`, if given, must be prepare_paper(ppt_data), and ppt_data must not
+        have been mutated since it was prepared; otherwise the scores describe the
+        paper as it was then. Without it the paper is prepared for this call.
+        """
+        if paper is None:
+            paper = self.prepare_paper(ppt_data)
+        return self._score_prepared(ppt_data, paper, response_data)
+
+    def _score_prepared(self, ppt_data: dict, paper: PreparedPaper, response_data: dict) -> dict:
+        # (user answer, status code, marks) per question, in paper order
+        outcomes = []
+
+        # Question indices grouped by status code, for the metadata stats
+        indices_by_status = ([], [], [])
+
+        # Score aggregators are [score, correct, incorrect, unattempted, total_questions]
+        # rows indexed by status code, turned into dicts once scoring is done. The
+        # extra last section row collects questions from unconfigured sections.
+        section_rows = [[0, 0, 0, 0, 0] for _ in range(len(paper.sections) + 1)]
+        # Chapters are known up front, in the order they first appear
+        chapter_rows = [[0, 0, 0, 0, 0] for _ in paper.chapter_tags]
+        # Total stats aggregators: [score, correct, incorrect, unattempted]
+        totals = [0, 0, 0, 0]
+
+        # Bound once so the loop below avoids repeated attribute lookups
+        get_response = response_data.get
+
+        for i, (_, uuid, _, _, section_idx, chapter_idx, positive_marks, negative_marks, correct_norm) in enumerate(paper.questions):
+            user_ans = get_response(uuid)
+
+            if user_ans is None:
+                status_code = _UNATTEMPTED
+                marks = 0
+            # Exact match first: answers usually arrive as already-trimmed strings, which
+            # skips the str()/strip() calls. Otherwise normalize to string just in case.
+            elif user_ans == correct_norm or str(user_ans).strip() == correct_norm:
+                status_code = _CORRECT
+                marks = positive_marks
             else:
-                total_unattempted += 1
+                status_code = _INCORRECT
+                marks = negative_marks
+
+            # Aggregate section, chapter and total stats
+            section_row = section_rows[section_idx]
+            section_row[0] += marks
+            section_row[1 + status_code] += 1
+            section_row[4] += 1
+            chapter_row = chapter_rows[chapter_idx]
+            chapter_row[0] += marks
+            chapter_row[1 + status_code] += 1
+            chapter_row[4] += 1
+            totals[0] += marks
+            totals[1 + status_code] += 1
+
+            outcomes.append((user_ans, status_code, marks))
+            indices_by_status[status_code].append(i)
+
+        # Construct output with desired order
 
-            blunder = (status == 'Incorrect' and str(q.get('difficulty', '')).strip().upper() == 'E')
+        # 1. Test details (everything from ppt_data except questions), copied in one go
+        output = dict(ppt_data)
+        output.pop('questions', None)
 
-            attempt_comparison.append({
+        # 2. Existing score data, built in one pass over the paper and its outcomes
+        output["attempt_comparison"] = [
+            {
                 "question_uuid": uuid,
-                "question_id": q_id,
+                "question_id": q.get('id'),
                 "section": section_name,
                 "chapter_tag": chapter_tag,
                 "user_response": user_ans,
-                "correct_response": correct_ans,
-                "status": status,
+                "correct_response": q.get('correctAnswer'),
+                "status": _STATUS_NAMES[status_code],
                 "marks_awarded": marks,
-                "blunder": blunder
-            })
-
-            # --- Collect Metadata Stats ---
-            bin_key = status.lower() # correct, incorrect, unattempted
-
-            def update_meta(field, val):
-                if val is not None:
-                    val_str = str(val)
-                    metadata_stats[bin_key][field][val_str] = metadata_stats[bin_key][field].get(val_str, 0) + 1
-
-            # Difficulty
-            update_meta('difficulty', q.get('difficulty'))
-
-            # Relevance
-            update_meta('relevance', q.get('jeeMainsRelevance'))
-
-            # Scary/Calculation
-            update_meta('scary', q.get('scary'))
-            update_meta('lengthy', q.get('lengthy'))
-
-            # Topics
-            # Check for topicTags (new format)
-            topic_tags = q.get('topicTags')
-            if topic_tags and isinstance(topic_tags, list):
-                if chapter_tag and chapter_tag in self.chapter_topics_map:
-                    chapter_topics = self.chapter_topics_map[chapter_tag]
-                    for t_id in topic_tags:
-                        t_name = chapter_topics.get(str(t_id))
-                        if t_name:
-                            update_meta('topics', f"{chapter_tag}-{t_id}")
-
-        # Construct output with desired order
-        output = {}
-
-        # 1. Test details (everything from ppt_data except questions)
-        for key, value in ppt_data.items():
-            if key != 'questions':
-                output[key] = value
-
-        # 2. Existing score data
-        output["attempt_comparison"] = attempt_comparison
-        output["section_scores"] = section_scores
-        output["chapter_scores"] = chapter_scores
+                "blunder": status_code == _INCORRECT and easy
+            }
+            for (q, uuid, section_name, chapter_tag, _, _, _, _, _), (user_ans, status_code, marks), easy
+            in zip(paper.questions, outcomes, paper.easy)
+        ]
+        # zip() stops before the unconfigured-section row
+        output["section_scores"] = {name: _score_row_to_dict(row) for name, row in zip(paper.sections, section_rows)}
+        output["chapter_scores"] = {tag: _score_row_to_dict(row) for tag, row in zip(paper.chapter_tags, chapter_rows)}
 
         # 3. New Metadata Stats
-        output["metadata_stats"] = metadata_stats
+        output["metadata_stats"] = {
+            bin_key: _count_metadata(paper, indices)
+            for bin_key, indices in zip(_METADATA_BINS, indices_by_status)
+        }
 
         # 4. Total stats at the end
+        total_score, total_correct, total_incorrect, total_unattempted = totals
         output["total_stats"] = {
             "total_score": total_score,
-            "total_questions": total_questions_count,
+            "total_questions": len(paper.questions),
             "total_attempted": total_correct + total_incorrect,
             "total_correct": total_correct,
             "total_wrong": total_incorrect, # Using "total_wrong" as requested "total wrong"
@@ -252,48 +284,59 @@ class ScoreService:
 
         return output
 
+    @cached_property
+    def _github_headers(self) -> Dict[str, str]:
+        # Settings are fixed for the process lifetime, so the headers are built once
+        return {
+            "Authorization": f"Bearer {settings.GITHUB_TOKEN}",
+            "Accept": "application/vnd.github.v3+json",
+            "X-GitHub-Api-Version": "2022-11-28"
+        }
+
+    @cached_property
+    def _github_put_headers(self) -> Dict[str, str]:
+        return {**self._github_headers, "Content-Type": "application/json"}
+
     async def push_to_github(self, data: dict, filename: str) -> str:
         """
-        Pushes the data to a GitHub repository using the async HTTP client.
+        Pushes the data to a GitHub repository using the shared HTTP client.
         Returns the URL of the pushed file.
         """
         if not settings.GITHUB_TOKEN or not settings.GITHUB_REPO:
             raise ValueError("GITHUB_TOKEN and GITHUB_REPO must be set in configuration")
 
         base_url = f"https://api.github.com/repos/{settings.GITHUB_REPO}/contents/{filename}"
-        headers = {
-            "Authorization": f"Bearer {settings.GITHUB_TOKEN}",
-            "Accept": "application/vnd.github.v3+json",
-            "X-GitHub-Api-Version": "2022-11-28"
-        }
+        headers = self._github_headers
 
-        content_str = json.dumps(data, indent=4)
-        content_encoded = base64.b64encode(content_str.encode("utf-8")).decode("utf-8")
+        # orjson writes UTF-8 bytes directly; non-string keys (e.g. a missing chapter
+        # tag) are written as strings, as json.dumps did
+        content_bytes = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        content_encoded = base64.b64encode(content_bytes).decode("ascii")
 
         message = f"Add score results for {filename}"
 
-        async with httpx.AsyncClient() as client:
-            # Check if file exists to get SHA (for update)
-            sha = None
-            try:
-                get_response = await client.get(base_url, headers=headers)
-                if get_response.status_code == 200:
-                    sha = get_response.json().get("sha")
-            except Exception as e:
-                logger.warning(f"Failed to check if file exists: {e}")
-
-            payload = {
-                "message": message,
-                "content": content_encoded
-            }
-            if sha:
-                payload["sha"] = sha
+        client = await http_client.get_client()
+        put_headers = self._github_put_headers
+
+        # Result files are normally new, so try creating the file without a SHA first
+        payload = {
+            "message": message,
+            "content": content_encoded
+        }
+        response = await send_with_retry(client, "PUT", base_url, headers=put_headers, content=orjson.dumps(payload))
+
+        if response.status_code in (409, 422):
+            # The file already exists (e.g. a rescore): updating it needs its current SHA
+            logger.info(f"{filename} already exists on GitHub, updating it")
+            get_response = await send_with_retry(client, "GET", base_url, headers=headers)
+            get_response.raise_for_status()
+            payload["sha"] = orjson.loads(get_response.content).get("sha")
+            response = await send_with_retry(client, "PUT", base_url, headers=put_headers, content=orjson.dumps(payload))
 
-            response = await client.put(base_url, headers=headers, json=payload)
-            response.raise_for_status()
+        response.raise_for_status()
 
-            resp_data = response.json()
-            # Return the download_url from the content object in the response
-            return resp_data.get("content", {}).get("download_url")
+        resp_data = orjson.loads(response.content)
+        # Return the download_url from the content object in the response
+        return resp_data.get("content", {}).get("download_url")
 
 score_service = ScoreService()
@@ -0,0 +1,116 @@
+import asyncio
+import base64
+import json
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.core.http import HTTPClientManager
+from app.services import analytics_service as analytics_module
+
+
+class FakeContentsAPI:
+    """Minimal GitHub contents API: one file per path, PUTs must carry the current SHA."""
+
+    def __init__(self):
+        self.files = {}
+        self.methods = []
+
+    def __call__(self, request):
+        self.methods.append(request.method)
+        path = request.url.path.split("/contents/")[1]
+        if request.method == "GET":
+            if path not in self.files:
+                return httpx.Response(404, json={})
+            sha, content = self.files[path]
+            return httpx.Response(200, json={"sha": sha, "content": base64.b64encode(content).decode()})
+
+        body = json.loads(request.content)
+        current = self.files.get(path)
+        if current and body.get("sha") != current[0]:
+            return httpx.Response(409, json={"message": "sha mismatch"})
+        new_sha = f"sha-{len(self.methods)}"
+        self.files[path] = (new_sha, base64.b64decode(body["content"]))
+        return httpx.Response(200, json={"content": {"sha": new_sha, "download_url": f"https://raw/{path}"}})
+
+    def history(self, path):
+        return json.loads(self.files[path][1])
+
+
+@pytest.fixture
+def github(monkeypatch):
+    api = FakeContentsAPI()
+    monkeypatch.setattr(settings, "GITHUB_TOKEN", "token")
+    monkeypatch.setattr(settings, "GITHUB_REPO", "owner/repo")
+    monkeypatch.setattr(HTTPClientManager, "client", httpx.AsyncClient(transport=httpx.MockTransport(api)))
+    analytics_module._github_file_cache.clear()
+    yield api
+    analytics_module._github_file_cache.clear()
+
+
+def test_update_github_history_reuses_cached_sha_and_resyncs_when_stale(github):
+    service = analytics_module.AnalyticsService()
+    filename = "user_analytics/u1.json"
+
+    async def go():
+        await service._update_github_history(filename, [{"n": 1}])
+        await service._update_github_history(filename, [{"n": 2}])
+        # Written by another worker: the cached SHA is now stale
+        github.files[filename] = ("external", json.dumps(github.history(filename) + [{"n": "ext"}]).encode())
+        return await service._update_github_history(filename, [{"n": 3}])
+
+    url = asyncio.run(go())
+
+    assert url == f"https://raw/{filename}"
+    assert github.methods == ["GET", "PUT", "PUT", "PUT", "GET", "PUT"]
+    assert github.history(filename) == [{"n": 1}, {"n": 2}, {"n": "ext"}, {"n": 3}]
+
+
+def test_history_entries_queued_behind_a_write_share_the_next_one(github):
+    service = analytics_module.AnalyticsService()
+
+    async def go():
+        first = asyncio.create_task(service._history_writer.submit("user_analytics/u1.json", {"n": 1}))
+        # Let the first write start; the next two u1 entries queue behind it
+        await asyncio.sleep(0)
+        return await asyncio.gather(
+            first,
+            service._history_writer.submit("user_analytics/u2.json", {"n": 2}),
+            service._history_writer.submit("user_analytics/u1.json", {"n": 3}),
+            service._history_writer.submit("user_analytics/u1.json", {"n": 4}),
+        )
+
+    urls = asyncio.run(go())
+
+    assert urls == [
+        "https://raw/user_analytics/u1.json",
+        "https://raw/user_analytics/u2.json",
+        "https://raw/user_analytics/u1.json",
+        "https://raw/user_analytics/u1.json",
+    ]
+    # u1: one write for {"n": 1}, one for the two entries that queued behind it
+    assert github.methods.count("PUT") == 3
+    assert github.history("user_analytics/u1.json") == [{"n": 1}, {"n": 3}, {"n": 4}]
+
+
+def test_update_chapter_stats_writes_non_string_chapter_keys(github):
+    service = analytics_module.AnalyticsService()
+    scores = {"correct": 1, "incorrect": 0, "unattempted": 1, "total_questions": 2}
+
+    url = asyncio.run(service._update_chapter_stats("u1", {None: scores, "C1": scores}, "now"))
+
+    assert url == "https://raw/user_analytics/chapters/u1.json"
+    chapters = github.history("user_analytics/chapters/u1.json")["chapters"]
+    assert chapters["null"]["attempted"] == 1
+    assert chapters["C1"]["total_questions"] == 2
+
+
+def test_score_digest_matches_scores_read_back_from_json():
+    computed = {"section_scores": {"Physics": {"score": 4.0}}, "chapter_scores": {None: {"score": 4.0}}}
+    read_back = json.loads(json.dumps(computed))
+
+    assert analytics_module._score_digest(computed) == analytics_module._score_digest(read_back)
+    assert analytics_module._score_digest(computed) != analytics_module._score_digest({**computed, "total_stats": {"total_score": 4}})
+    # Fields analytics doesn't read are not hashed
+    assert analytics_module._score_digest(computed) == analytics_module._score_digest({**computed, "attempt_comparison": [1]})
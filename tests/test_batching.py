@@ -0,0 +1,57 @@
+import asyncio
+
+from app.core.batching import KeyedCoalescer
+
+
+def test_keyed_coalescer_runs_idle_keys_immediately():
+    calls = []
+
+    async def handler(key, items):
+        calls.append((key, list(items)))
+        return key
+
+    async def go():
+        coalescer = KeyedCoalescer(handler)
+        # Nothing else is queued, so this must not wait for a batching window
+        return await asyncio.wait_for(coalescer.submit("a", 1), timeout=0.05)
+
+    assert asyncio.run(go()) == "a"
+    assert calls == [("a", [1])]
+
+
+def test_keyed_coalescer_merges_items_queued_behind_a_running_call():
+    calls = []
+    release = None
+
+    async def handler(key, items):
+        calls.append((key, list(items)))
+        if len(calls) == 1:
+            await release.wait()
+        return len(items)
+
+    async def go():
+        nonlocal release
+        release = asyncio.Event()
+        coalescer = KeyedCoalescer(handler)
+        first = asyncio.create_task(coalescer.submit("a", 1))
+        await asyncio.sleep(0)
+        queued = [asyncio.create_task(coalescer.submit("a", i)) for i in (2, 3)]
+        other = await coalescer.submit("b", 9)
+        release.set()
+        return await first, await asyncio.gather(*queued), other
+
+    first, queued, other = asyncio.run(go())
+    assert (first, queued, other) == (1, [2, 2], 1)
+    assert calls == [("a", [1]), ("b", [9]), ("a", [2, 3])]
+
+
+def test_keyed_coalescer_propagates_handler_errors():
+    async def handler(key, items):
+        raise ValueError(key)
+
+    async def go():
+        coalescer = KeyedCoalescer(handler)
+        return await asyncio.gather(coalescer.submit("a", 1), coalescer.submit("a", 2), return_exceptions=True)
+
+    results = asyncio.run(go())
+    assert all(isinstance(r, ValueError) for r in results)
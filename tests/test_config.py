@@ -0,0 +1,10 @@
+import pytest
+
+from app.core.config import Settings
+
+
+@pytest.mark.parametrize("value", ["http://a, http://b", '["http://a", "http://b"]'])
+def test_cors_origins_accept_comma_separated_and_json_lists(monkeypatch, value):
+    monkeypatch.setenv("BACKEND_CORS_ORIGINS", value)
+
+    assert Settings().BACKEND_CORS_ORIGINS == ("http://a", "http://b")
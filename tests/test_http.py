@@ -0,0 +1,69 @@
+import asyncio
+
+import httpx
+
+from app.core import http
+
+
+def _run(handler, method="GET", **kwargs):
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await http.send_with_retry(client, method, "https://example.com/x", base_delay=0, **kwargs)
+    return asyncio.run(go())
+
+
+def test_send_with_retry_retries_rate_limited_requests():
+    statuses = iter([429, 503, 200])
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(next(statuses), headers={"Retry-After": "0"})
+
+    response = _run(handler)
+
+    assert response.status_code == 200
+    assert len(calls) == 3
+
+
+def test_send_with_retry_returns_last_response_when_attempts_exhausted():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(502)
+
+    response = _run(handler, attempts=2)
+
+    assert response.status_code == 502
+    assert len(calls) == 2
+
+
+def test_send_with_retry_does_not_retry_client_errors_or_long_waits():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            return httpx.Response(404)
+        return httpx.Response(429, headers={"Retry-After": "3600"})
+
+    assert _run(handler).status_code == 404
+    assert _run(handler).status_code == 429
+    assert len(calls) == 2
+
+
+def test_send_with_retry_only_retries_gateway_errors_for_idempotent_methods():
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        if request.method == "PUT" and calls.count("PUT") == 1:
+            # Rate limited: the write wasn't applied and is safe to resend
+            return httpx.Response(429, headers={"Retry-After": "0"})
+        return httpx.Response(502)
+
+    # The second PUT may have been applied behind the 502, so it isn't resent
+    assert _run(handler, method="PUT").status_code == 502
+    assert _run(handler, attempts=2).status_code == 502
+    assert calls == ["PUT", "PUT", "GET", "GET"]
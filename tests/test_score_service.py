@@ -1,4 +1,11 @@
+import asyncio
+import json
+
+import httpx
 import pytest
+
+from app.core.config import settings
+from app.core.http import HTTPClientManager
 from app.services.score_service import ScoreService
 
 
@@ -62,3 +69,49 @@ def test_calculate_score_sets_blunder_for_easy_incorrect():
 
     assert q3["status"] == "Unattempted"
     assert q3["blunder"] is False
+
+
+def test_calculate_score_with_prepared_paper_matches_unprepared():
+    service = ScoreService()
+
+    ppt_data = {
+        "sections": [{"name": "Section1", "marksPerQuestion": 4, "negativeMarksPerQuestion": -1}],
+        "questions": [
+            {"uuid": "q1", "id": "1", "section": "Section1", "correctAnswer": "A", "chapterCode": "C1"},
+            {"uuid": "q2", "id": "2", "section": "Section2", "correctAnswer": 3, "tags": {"tag2": "C2"}}
+        ]
+    }
+    paper = service.prepare_paper(ppt_data)
+
+    for response_data in ({"q1": "A", "q2": "3"}, {"q1": "B"}, {}):
+        assert service.calculate_score(ppt_data, response_data, paper) == service.calculate_score(ppt_data, response_data)
+    assert service.calculate_score(ppt_data, {"q1": "B"}, paper)["total_stats"]["total_score"] == -1
+
+
+def test_push_to_github_creates_without_sha_and_falls_back_for_existing_files(monkeypatch):
+    files = {"existing.json": "sha-old"}
+    requests = []
+
+    def contents_api(request):
+        path = request.url.path.split("/contents/")[1]
+        if request.method == "GET":
+            requests.append(("GET", None))
+            return httpx.Response(200, json={"sha": files[path]})
+        sha = json.loads(request.content).get("sha")
+        requests.append(("PUT", sha))
+        if path in files and sha != files[path]:
+            return httpx.Response(422, json={"message": "sha wasn't supplied"})
+        files[path] = "sha-new"
+        return httpx.Response(201, json={"content": {"download_url": f"https://raw/{path}"}})
+
+    monkeypatch.setattr(settings, "GITHUB_TOKEN", "token")
+    monkeypatch.setattr(settings, "GITHUB_REPO", "owner/repo")
+    monkeypatch.setattr(HTTPClientManager, "client", httpx.AsyncClient(transport=httpx.MockTransport(contents_api)))
+    service = ScoreService()
+
+    assert asyncio.run(service.push_to_github({"a": 1}, "new.json")) == "https://raw/new.json"
+    assert requests == [("PUT", None)]
+
+    requests.clear()
+    assert asyncio.run(service.push_to_github({"a": 1}, "existing.json")) == "https://raw/existing.json"
+    assert requests == [("PUT", None), ("GET", None), ("PUT", "sha-old")]
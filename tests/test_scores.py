@@ -0,0 +1,171 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import BackgroundTasks
+
+from app.api.endpoints import scores
+from app.core.config import settings
+from app.core.http import HTTPClientManager
+from app.schemas.score import ScoreBatchRequest
+
+TEST_URL = "https://raw/tests/t1.json"
+PAPER = {
+    "sections": [{"name": "Section1", "marksPerQuestion": 4, "negativeMarksPerQuestion": -1}],
+    "questions": [{"uuid": "q1", "id": "1", "section": "Section1", "correctAnswer": "A", "chapterCode": "C1"}],
+}
+SCORED_ID = "0b6f6c8e-3c1a-4d8e-9a39-2f4b0c5d7e11"
+UNSCORED_ID = "5d1c9a7e-8b2f-4e3a-b6d4-1f0e2c3a4b55"
+MISSING_ID = "9e8d7c6b-5a4f-4e3d-8c2b-1a0f9e8d7c66"
+
+
+class FakeQuery:
+    def __init__(self, rows):
+        self.rows = rows
+        self.columns = None
+        self.single = False
+        self.filters = []
+
+    def select(self, columns):
+        self.columns = columns.split(",")
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, {value}))
+        return self
+
+    def in_(self, column, values):
+        self.filters.append((column, set(values)))
+        return self
+
+    def maybe_single(self):
+        self.single = True
+        return self
+
+    def update(self, values, returning=None):
+        self.columns = None
+        self.values = values
+        return self
+
+    async def execute(self):
+        # Yield like a real round trip, so concurrent callers interleave
+        await asyncio.sleep(0)
+        matched = [row for row in self.rows if all(row.get(column) in values for column, values in self.filters)]
+        if self.columns is None:
+            for row in matched:
+                row.update(self.values)
+            return SimpleNamespace(data=[])
+        data = [{column: row.get(column) for column in self.columns} for row in matched]
+        if self.single:
+            # maybe_single() yields no response at all when the row is missing
+            return SimpleNamespace(data=data[0]) if data else None
+        return SimpleNamespace(data=data)
+
+
+class FakeSupabase:
+    """Minimal async Supabase client: exact-match filters over in-memory tables."""
+
+    def __init__(self, tables):
+        self.tables = tables
+
+    def table(self, name):
+        return FakeQuery(self.tables.setdefault(name, []))
+
+
+class FakeGitHub:
+    """Serves the test JSON (with an ETag) and accepts contents PUTs."""
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        if str(request.url) == TEST_URL:
+            if request.headers.get("If-None-Match") == '"v1"':
+                return httpx.Response(304)
+            return httpx.Response(200, json=PAPER, headers={"ETag": '"v1"'})
+        path = request.url.path.split("/contents/")[1]
+        return httpx.Response(201, json={"content": {"download_url": f"https://raw/{path}"}})
+
+    def puts(self):
+        return [request for request in self.requests if request.method == "PUT"]
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    supabase = FakeSupabase({
+        "student_tests": [
+            {"id": SCORED_ID, "user_id": "u1", "result_url": "https://raw/old.json"},
+            {"id": UNSCORED_ID, "user_id": "u1", "result_url": None, "test_id": "t1", "answers": {"q1": "A"}},
+        ],
+        "tests": [{"testID": "t1", "url": TEST_URL}],
+    })
+    github = FakeGitHub()
+
+    async def get_service_client():
+        return supabase
+
+    monkeypatch.setattr(scores.db, "get_service_client", get_service_client)
+    monkeypatch.setattr(scores, "_AUTH_ENABLED", False)
+    monkeypatch.setattr(settings, "GITHUB_TOKEN", "token")
+    monkeypatch.setattr(settings, "GITHUB_REPO", "owner/repo")
+    monkeypatch.setattr(HTTPClientManager, "client", httpx.AsyncClient(transport=httpx.MockTransport(github)))
+    scores._ppt_cache.clear()
+    scores._test_urls.clear()
+    yield SimpleNamespace(supabase=supabase, github=github)
+    scores._ppt_cache.clear()
+    scores._test_urls.clear()
+
+
+def test_batch_reports_invalid_missing_and_case_variant_ids(backend, monkeypatch):
+    request = ScoreBatchRequest(student_test_ids=["not-a-uuid", SCORED_ID.upper(), MISSING_ID, UNSCORED_ID])
+
+    response = asyncio.run(scores.calculate_student_test_scores_batch(request, BackgroundTasks(), None))
+
+    assert [(r.student_test_id, r.github_url) for r in response.results] == [
+        (SCORED_ID, "https://raw/old.json"),
+        (UNSCORED_ID, f"https://raw/{UNSCORED_ID}.json"),
+    ]
+    assert response.errors == {"not-a-uuid": "Invalid student test ID", MISSING_ID: "Student test not found"}
+
+    # Unexpected errors are reported against their ID instead of failing the batch
+    async def broken_push(data, filename):
+        raise RuntimeError("boom")
+
+    backend.supabase.tables["student_tests"][1]["result_url"] = None
+    monkeypatch.setattr(scores.score_service, "push_to_github", broken_push)
+    request = ScoreBatchRequest(student_test_ids=[UNSCORED_ID, SCORED_ID])
+
+    response = asyncio.run(scores.calculate_student_test_scores_batch(request, BackgroundTasks(), None))
+
+    assert [r.student_test_id for r in response.results] == [SCORED_ID]
+    assert response.errors == {UNSCORED_ID: "Error calculating score"}
+
+
+def test_concurrent_requests_for_one_attempt_share_one_calculation(backend):
+    async def go():
+        return await asyncio.gather(*(
+            scores.calculate_student_test_score(UNSCORED_ID, BackgroundTasks(), None) for _ in range(3)
+        ))
+
+    responses = asyncio.run(go())
+
+    assert {r.github_url for r in responses} == {f"https://raw/{UNSCORED_ID}.json"}
+    assert len(backend.github.puts()) == 1
+    assert scores._in_flight == {}
+
+
+def test_get_ppt_revalidates_with_etag_and_reuses_prepared_paper(backend):
+    ppt_data, paper = asyncio.run(scores._get_ppt(TEST_URL))
+    # Expire the entry so the next call revalidates instead of serving it as-is
+    fresh_until, etag, *cached = scores._ppt_cache.get(TEST_URL)
+    scores._ppt_cache.set(TEST_URL, (0, etag, *cached))
+
+    revalidated_ppt, revalidated_paper = asyncio.run(scores._get_ppt(TEST_URL))
+
+    assert revalidated_ppt is ppt_data
+    assert revalidated_paper is paper
+    assert [request.headers.get("If-None-Match") for request in backend.github.requests] == [None, '"v1"']
+    assert scores._ppt_cache.get(TEST_URL)[0] > time.monotonic()
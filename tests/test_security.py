@@ -0,0 +1,44 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+
+from app.core import security
+from app.core.config import settings
+
+
+@pytest.fixture(autouse=True)
+def jwt_secret(monkeypatch):
+    monkeypatch.setattr(settings, "SUPABASE_JWT_SECRET", "test-secret")
+    security._token_cache.clear()
+    yield
+    security._token_cache.clear()
+
+
+def _make_token(**claims):
+    return jwt.encode(claims, "test-secret", algorithm="HS256")
+
+
+def test_verify_token_caches_decoded_tokens(monkeypatch):
+    token = _make_token(sub="user-1", email="a@example.com", exp=int(time.time()) + 3600)
+
+    first = security.verify_token(token)
+
+    def fail_decode(*args, **kwargs):
+        raise AssertionError("cached token should not be decoded again")
+
+    monkeypatch.setattr(security.jwt, "decode", fail_decode)
+    second = security.verify_token(token)
+
+    assert first.id == "user-1"
+    assert second is first
+
+
+def test_verify_token_does_not_cache_expired_tokens():
+    token = _make_token(sub="user-1", exp=int(time.time()) - 10)
+
+    with pytest.raises(HTTPException):
+        security.verify_token(token)
+
+    assert len(security._token_cache) == 0